@@ -0,0 +1,124 @@
+# Configuration handling shared by the auto-reply bot and its setup flow.
+
+import os
+import re
+import json
+import stat
+import asyncio
+import threading
+import dataclasses
+from pyrogram import Client
+
+# File path for the configuration file
+CONFIG_FILE = 'config.json'
+
+# Offline message saved for a freshly configured bot
+DEFAULT_OFFLINE_MESSAGE = "I am currently offline and will get back to you as soon as possible. Thank you!"
+
+# Default window during which a chat gets at most one auto-reply
+DEBOUNCE_SECONDS = 60
+
+# Default cap on auto-replies in flight at once during a burst of DMs
+MAX_CONCURRENT_REPLIES = 8
+
+# Expected shape of the setup bot credentials message: `API_ID API_HASH`
+CREDS_RE = re.compile(r"^\s*([0-9]{1,12})\s+([0-9a-fA-F]{32})\s*$")
+
+SETUP_MESSAGE = """
+**Welcome to the Setup Wizard!**
+
+I need your Telegram API credentials to run the auto-reply bot on your account.
+1. Go to **[my.telegram.org](https://my.telegram.org)**.
+2. Log in and click on "API Development Tools".
+3. Create a new application to get your API ID and API Hash.
+
+Once you have them, send me a message in the following format:
+`API_ID API_HASH`
+(e.g., `123456 0123456789abcdef0123456789abcdef`)
+"""
+
+# --- Configuration Storage ---
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class BotConfig:
+    """Bot settings as stored in the configuration file. Immutable, so it can be shared between tasks."""
+    api_id: int
+    api_hash: str
+    offline_message: str = "I am currently offline."
+    session_string: str | None = None
+    response_delay: float = 0
+    debounce_seconds: float = DEBOUNCE_SECONDS
+    # Pyrogram update workers; each one awaits its handler, so this bounds how many run at once
+    workers: int = Client.WORKERS
+    max_concurrent_replies: int = MAX_CONCURRENT_REPLIES
+
+# Keys of the configuration file that map onto BotConfig; anything else is ignored on load
+_CONFIG_KEYS = frozenset(field.name for field in dataclasses.fields(BotConfig))
+
+class _ConfigCache:
+    """In-memory copy of the configuration file, refreshed only when the file's mtime changes."""
+    data = None
+    mtime_ns = None
+    # Serializes writes, which run on the default thread pool
+    lock = threading.Lock()
+
+def _save_config_sync(config: BotConfig, pretty: bool = False):
+    """
+    Saves the API ID, API Hash, offline message, session string and reply timings to a JSON file.
+    The file is written compactly unless `pretty` is set, which is used during interactive setup.
+    """
+    with _ConfigCache.lock:
+        try:
+            on_disk = os.stat(CONFIG_FILE)
+            on_disk_mtime_ns = on_disk.st_mtime_ns
+            # Keep the existing permissions, e.g. a user's chmod 600
+            file_mode = stat.S_IMODE(on_disk.st_mode)
+        except FileNotFoundError:
+            on_disk_mtime_ns = None
+            # The file holds the API Hash and session string, so keep it private by default
+            file_mode = 0o600
+        if config == _ConfigCache.data and on_disk_mtime_ns == _ConfigCache.mtime_ns:
+            # Nothing changed in memory or on disk, so there is no need to touch the file
+            return
+
+        # Write to a sibling temp file and swap it in so readers never see a partial file.
+        # The temp file is created owner-only and given the final mode before any data is written.
+        tmp_file = CONFIG_FILE + '.tmp'
+        try:
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w') as f:
+                os.chmod(tmp_file, file_mode)
+                if pretty:
+                    f.write(json.dumps(dataclasses.asdict(config), indent=4))
+                else:
+                    f.write(json.dumps(dataclasses.asdict(config), separators=(',', ':')))
+            os.replace(tmp_file, CONFIG_FILE)
+        except BaseException:
+            # Don't leave a stale temp file behind
+            try:
+                os.remove(tmp_file)
+            except FileNotFoundError:
+                pass
+            raise
+
+        _ConfigCache.data = config
+        _ConfigCache.mtime_ns = os.stat(CONFIG_FILE).st_mtime_ns
+    print("Configuration saved successfully!")
+
+async def save_config(config: BotConfig, pretty: bool = False):
+    """Saves the configuration without blocking the event loop on disk I/O."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _save_config_sync, config, pretty)
+
+def load_config():
+    """Loads the configuration from the JSON file, reusing the cached copy if the file is unchanged."""
+    try:
+        mtime_ns = os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if mtime_ns != _ConfigCache.mtime_ns:
+        with open(CONFIG_FILE, 'r') as f:
+            raw_config = json.loads(f.read())
+        _ConfigCache.data = BotConfig(**{key: value for key, value in raw_config.items() if key in _CONFIG_KEYS})
+        _ConfigCache.mtime_ns = mtime_ns
+    return _ConfigCache.data
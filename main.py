@@ -1,118 +1,168 @@
 # This script creates a Telegram self-bot that replies when you're away.
 # The initial setup and remote control are handled via a separate BotFather bot.
 
-import os
 import sys
-import json
+import queue
+import time
 import asyncio
-from pyrogram import Client, filters, idle
+import logging
+import dataclasses
+from logging.handlers import QueueHandler, QueueListener
+from pyrogram import Client, filters, idle, raw
+from pyrogram.errors import ApiIdInvalid
 from pyrogram.types import Message
 import getpass # Using getpass to hide sensitive input
+from config import BotConfig, CREDS_RE, DEFAULT_OFFLINE_MESSAGE, SETUP_MESSAGE, load_config, save_config
 
-# File path for the configuration file
-CONFIG_FILE = 'config.json'
 SESSION_NAME = 'user_bot_session'
 
-# --- Custom Exception for Clean Exit ---
-class SetupCompleteError(Exception):
-    """Custom exception to signal that setup is complete and the script should exit."""
-    pass
-
-# --- Configuration & Setup Logic ---
-
-def save_config(api_id: int, api_hash: str, offline_message: str, session_string: str = None):
-    """Saves the API ID, API Hash, offline message, and session string to a JSON file."""
-    config = {
-        'api_id': api_id,
-        'api_hash': api_hash,
-        'offline_message': offline_message,
-        'session_string': session_string
-    }
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
-    print("Configuration saved successfully!")
-
-def load_config():
-    """Loads the configuration from the JSON file."""
-    if not os.path.exists(CONFIG_FILE):
-        return None
-    with open(CONFIG_FILE, 'r') as f:
-        return json.load(f)
+logger = logging.getLogger(__name__)
+
+# Handler filters, built once and ordered so the cheapest check runs first
+_START = filters.private & filters.command("start")
+_PRIVATE_NOT_ME = ~filters.me & filters.private
+_EDITOFF = filters.me & filters.command("editoff")
+_PRIVATE_INCOMING_NOT_ME = ~filters.me & filters.incoming & filters.private
+
+# Offline message used by the auto-reply handler; set from the config at startup and updated by /editoff
+_CURRENT_OFFLINE_MSG: str | None = None
+
+# Per-chat debounce so a burst of messages only gets one auto-reply
+_PRUNE_EVERY = 1000
+_LAST_REPLY: dict[int, float] = {}
+_reply_count = 0
+
+# --- Logging ---
+
+def setup_logging():
+    """Sends log records through a queue so console output is written on a background thread."""
+    log_queue = queue.SimpleQueue()
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(log_queue, console_handler)
+
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener.start()
+    return listener
 
 # --- BotFather Bot for Initial Setup ---
 
+_INVALID_FORMAT_MESSAGE = "Invalid format. Please send `API_ID API_HASH`, where the API Hash is 32 hexadecimal characters."
+_INVALID_CREDENTIALS_MESSAGE = "Invalid API ID or API Hash. Please check them and try again."
+_VALIDATION_TIMEOUT_MESSAGE = (
+    "Validation timed out. This usually means the API ID is invalid, as Telegram keeps "
+    "rejecting the connection. Please check it and try again."
+)
+_SETUP_COMPLETE_MESSAGE = (
+    "Credentials saved successfully! The bot is now configured.\n\n"
+    "Please return to the terminal to finish logging in to your account."
+)
+
+# Upper bound on the credential probe; pyrogram retries a failing connect() indefinitely
+_VALIDATION_TIMEOUT = 30
+
+async def _validate_credentials(client: Client, api_id: int, api_hash: str):
+    """
+    Checks the API ID and API Hash against Telegram without logging in.
+    connect() only sends the API ID (in initConnection), so an RPC that carries both values is made
+    afterwards. Raises ApiIdInvalid if Telegram rejects the pair.
+    """
+    await client.connect()
+    await client.invoke(raw.functions.auth.ExportLoginToken(api_id=api_id, api_hash=api_hash, except_ids=[]))
+
+async def _close_partial_client(client: Client):
+    """Releases what a cancelled or failed connect() left open: the session's connection and tasks, and the storage."""
+    session = getattr(client, "session", None)
+    if session is not None:
+        try:
+            await session.stop()
+        except Exception:
+            pass
+    try:
+        await client.storage.close()
+    except Exception:
+        pass
+
 async def setup_with_bot_father(bot_token, api_id, api_hash):
     """
     Guides the user through setting up the API credentials using a BotFather bot.
+    Returns the saved configuration once valid credentials have been received.
     """
     print("\nStarting the setup bot...")
     try:
-        # Initialize the client with provided credentials
-        setup_app = Client("setup_session", bot_token=bot_token, api_id=api_id, api_hash=api_hash)
+        # Initialize the client with provided credentials; the session is kept in memory only
+        setup_app = Client("setup_session", bot_token=bot_token, api_id=api_id, api_hash=api_hash, in_memory=True)
     except Exception as e:
         print(f"Error: Could not initialize setup client. Please check your bot token, API ID, and API Hash. ({e})")
         sys.exit(1)
 
-    setup_message = """
-**Welcome to the Setup Wizard!**
-
-I need your Telegram API credentials to run the auto-reply bot on your account.
-1. Go to **[my.telegram.org](https://my.telegram.org)**.
-2. Log in and click on "API Development Tools".
-3. Create a new application to get your API ID and API Hash.
+    # Resolved by the credential handler once the configuration has been saved
+    setup_done = asyncio.get_running_loop().create_future()
 
-Once you have them, send me a message in the following format:
-`API_ID API_HASH`
-(e.g., `123456 0123456789abcdef0123456789abcdef`)
-"""
-
-    @setup_app.on_message(filters.command("start") & filters.private)
+    @setup_app.on_message(_START)
     async def start_handler(client, message: Message):
-        await message.reply_text(setup_message, disable_web_page_preview=True)
+        await message.reply_text(SETUP_MESSAGE, disable_web_page_preview=True)
 
-    @setup_app.on_message(filters.private & ~filters.me)
+    @setup_app.on_message(_PRIVATE_NOT_ME)
     async def credential_handler(client, message: Message):
+        # Bound once, as the handler replies several times
+        reply_text = message.reply_text
+        text = message.text
         try:
-            if message.text.startswith('/'):
+            if text.startswith('/'):
                 # Ignore other commands
                 return
 
-            parts = message.text.split()
-            if len(parts) != 2:
-                await message.reply_text("Invalid format. Please send `API_ID API_HASH`.")
+            match = CREDS_RE.match(text)
+            if not match:
+                await reply_text(_INVALID_FORMAT_MESSAGE)
                 return
 
-            api_id_str, api_hash = parts
-            api_id = int(api_id_str)
+            api_id = int(match.group(1))
+            api_hash = match.group(2)
 
-            # Validate credentials by trying to start a temporary client
-            await message.reply_text("Credentials received. Validating...")
-            test_client = Client("test_session", api_id=api_id, api_hash=api_hash)
+            # The regex has already checked the shape; now validate the credentials with a temporary
+            # client, skipping the login and update-state fetch that start() would do.
+            await reply_text("Credentials received. Validating...")
+            test_client = Client("test_session", api_id=api_id, api_hash=api_hash, in_memory=True)
             try:
-                await test_client.start()
-                await test_client.stop()
+                await asyncio.wait_for(_validate_credentials(test_client, api_id, api_hash), _VALIDATION_TIMEOUT)
+            except ApiIdInvalid:
+                await reply_text(_INVALID_CREDENTIALS_MESSAGE)
+                return
+            except asyncio.TimeoutError:
+                print("Timed out while validating the credentials.")
+                await reply_text(_VALIDATION_TIMEOUT_MESSAGE)
+                return
             except Exception as e:
                 print(f"Test client failed with unknown error: {e}")
-                await message.reply_text("Invalid API ID or API Hash. Please check them and try again.")
+                await reply_text(_INVALID_CREDENTIALS_MESSAGE)
                 return
+            finally:
+                if test_client.is_connected:
+                    await test_client.disconnect()
+                else:
+                    # connect() was interrupted before it finished, so disconnect() would refuse to run
+                    await _close_partial_client(test_client)
 
-            save_config(api_id, api_hash, "I am currently offline and will get back to you as soon as possible. Thank you!")
-            await message.reply_text("Credentials saved successfully! The bot is now configured.")
-            await message.reply_text("Please restart the main script to start your auto-reply bot.")
-            
-            # The script will now exit gracefully
-            raise SetupCompleteError("Setup is complete. Exiting cleanly.")
+            config = BotConfig(api_id, api_hash, DEFAULT_OFFLINE_MESSAGE)
+            await save_config(config, pretty=True)
+            await reply_text(_SETUP_COMPLETE_MESSAGE)
+
+            # Hand the saved configuration back to main() to continue in the same process
+            if not setup_done.done():
+                setup_done.set_result(config)
 
-        except ValueError:
-            await message.reply_text("Invalid API ID. It must be a number.")
         except Exception as e:
-            await message.reply_text(f"An error occurred: {e}")
+            await reply_text(f"An error occurred: {e}")
 
     print("Please open your BotFather bot chat and send the /start command.")
     print("The setup bot is now waiting for your input...")
 
     async with setup_app:
-        await setup_app.run()
+        return await setup_done
 
 # --- Main Auto-Reply Bot Logic ---
 
@@ -127,19 +177,35 @@ async def setup_user_session():
 
     try:
         # Create a client to handle the interactive login
-        user_client = Client(SESSION_NAME, api_id=config['api_id'], api_hash=config['api_hash'])
+        user_client = Client(SESSION_NAME, api_id=config.api_id, api_hash=config.api_hash)
 
         async with user_client:
             # Let Pyrogram handle the interactive phone number login
             print("Successfully authenticated. Exporting session string...")
             session_string = await user_client.export_session_string()
-            save_config(config['api_id'], config['api_hash'], config['offline_message'], session_string)
+            await save_config(dataclasses.replace(config, session_string=session_string), pretty=True)
             print("Session string exported and saved successfully!")
             
     except Exception as e:
         print(f"An error occurred during user authentication: {e}")
         sys.exit(1)
 
+def _should_reply(chat_id: int, debounce_seconds: float) -> bool:
+    """Returns False if the chat was already auto-replied to within the debounce window."""
+    global _reply_count
+    now = time.monotonic()
+    last = _LAST_REPLY.get(chat_id)
+    if last is not None and now - last < debounce_seconds:
+        return False
+    _LAST_REPLY[chat_id] = now
+
+    # Periodically drop chats whose window has expired so the dict doesn't grow forever
+    _reply_count += 1
+    if _reply_count % _PRUNE_EVERY == 0:
+        for stale_id in [cid for cid, ts in _LAST_REPLY.items() if now - ts >= debounce_seconds]:
+            del _LAST_REPLY[stale_id]
+    return True
+
 async def main():
     """Main function to run the auto-reply bot."""
     config = load_config()
@@ -155,57 +221,91 @@ async def main():
         
         if api_id_str and api_hash:
             # Terminal-based setup
+            # Check the credentials' shape locally before they are used to log in
+            match = CREDS_RE.match(f"{api_id_str} {api_hash}")
+            if not match:
+                print("Invalid API ID or Hash provided. The API ID must be a number and the API Hash 32 hexadecimal characters.")
+                sys.exit(1)
+            api_id = int(match.group(1))
+            api_hash = match.group(2)
             try:
-                api_id = int(api_id_str)
                 # Save the config without session string and proceed to user login
-                save_config(api_id, api_hash, "I am currently offline and will get back to you as soon as possible. Thank you!")
-                print("Credentials saved. Please re-run the script to start the user session setup.")
-                return
-            except (ValueError, Exception) as e:
-                print(f"Invalid API ID or Hash provided. Please check and try again. ({e})")
+                config = BotConfig(api_id, api_hash, DEFAULT_OFFLINE_MESSAGE)
+                await save_config(config, pretty=True)
+                print("Credentials saved.")
+            except OSError as e:
+                print(f"Could not save the configuration file. Please check that it is writable. ({e})")
                 sys.exit(1)
         else:
             # Bot-based setup
-            try:
-                await setup_with_bot_father(bot_token, api_id=0, api_hash='') # Dummy credentials
-            except SetupCompleteError:
-                print("Setup process finished. Please re-run the script to start the main bot.")
-                return
+            config = await setup_with_bot_father(bot_token, api_id=0, api_hash='') # Dummy credentials
+            print("Setup process finished.")
 
     # Check if a session string exists for the user bot
-    if 'session_string' not in config or not config['session_string']:
+    if not config.session_string:
         print("User session not found. Starting one-time user authentication process...")
         await setup_user_session()
-        print("User session created. Please re-run the script to start the main bot.")
-        return
+        print("User session created.")
+        config = load_config()
+
+    global _CURRENT_OFFLINE_MSG
+    _CURRENT_OFFLINE_MSG = config.offline_message
+    response_delay = config.response_delay
+    debounce_seconds = config.debounce_seconds
+
+    # Auto-replies are capped by a semaphore. Dispatcher workers each await their handler, so the
+    # pool is kept at least one larger than the cap; otherwise the worker count would be the real limit.
+    reply_sem = asyncio.Semaphore(config.max_concurrent_replies)
+    workers = max(config.workers, config.max_concurrent_replies + 1)
 
     # Create and run the main auto-reply client
     try:
-        app = Client(SESSION_NAME, session_string=config['session_string'])
+        app = Client(
+            SESSION_NAME,
+            session_string=config.session_string,
+            workers=workers,
+        )
 
-        @app.on_message(filters.command("editoff") & filters.me)
+        @app.on_message(_EDITOFF)
         async def edit_offline_message(client, message: Message):
             """Handles the /editoff command to update the offline message."""
+            global _CURRENT_OFFLINE_MSG
+            nonlocal config
             try:
                 new_message = message.text.split(" ", 1)[1].strip()
-                config['offline_message'] = new_message
-                save_config(config['api_id'], config['api_hash'], new_message, config.get('session_string'))
+                new_config = dataclasses.replace(config, offline_message=new_message)
+                await save_config(new_config)
+                # Only switch over once the new message has been saved
+                config = new_config
+                _CURRENT_OFFLINE_MSG = new_message
                 await message.reply_text(f"Offline message updated successfully to: \n`{new_message}`")
             except IndexError:
                 await message.reply_text("Please provide a new message after the /editoff command.\nExample: `/editoff I will reply later.`")
             except Exception as e:
                 await message.reply_text(f"An error occurred: {e}")
 
-        @app.on_message(filters.private & filters.incoming & ~filters.me)
+        @app.on_message(_PRIVATE_INCOMING_NOT_ME)
         async def auto_reply(client, message: Message):
             """Automatically replies to incoming private messages."""
             try:
-                current_message = config.get('offline_message', "I am currently offline.")
-                await asyncio.sleep(3)  # Small delay for natural response
-                await message.reply(current_message)
-                print(f"Replied to {message.from_user.first_name} with: '{current_message}'")
+                chat_id = message.chat.id
+                if not _should_reply(chat_id, debounce_seconds):
+                    return
+                current_message = _CURRENT_OFFLINE_MSG
+                reply = message.reply
+                async with reply_sem:
+                    # Optional delay for a more natural response; disabled by default
+                    if response_delay > 0:
+                        await asyncio.sleep(response_delay)
+                    try:
+                        await reply(current_message)
+                    except Exception:
+                        # The reply never went out, so don't hold the chat in the debounce window
+                        _LAST_REPLY.pop(chat_id, None)
+                        raise
+                logger.info("Replied to %s with: '%s'", message.from_user.first_name, current_message)
             except Exception as e:
-                print(f"An error occurred: {e}")
+                logger.error("An error occurred: %s", e)
 
         print("Telegram Auto-reply bot is starting...")
         print("Press Ctrl+C to stop the bot.")
@@ -217,4 +317,8 @@ async def main():
         print(f"An error occurred while starting the main bot. Please check your configuration. ({e})")
         
 if __name__ == "__main__":
-    asyncio.run(main())
+    log_listener = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()